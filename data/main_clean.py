@@ -11,10 +11,17 @@ This script runs all data processing steps in the correct order:
 6. Create timeline data
 7. Create detention journey data
 
+Steps 5-7 only read the workbook caches built in step 1, so they start in
+worker processes as soon as it finishes. Steps 2-4 run in this process
+meanwhile; only step 4 needs the geocoded output.
+
 Run with: uv run data/main_clean.py
 """
 
+import multiprocessing
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 # Add processing directory to path
@@ -30,6 +37,11 @@ from create_timeline import create_timeline_data
 from create_detention_journey import create_detention_journey_data
 
 
+def limit_polars_threads(n_threads):
+    """Caps the Polars thread pool of a worker process; the pool is sized on first use."""
+    os.environ["POLARS_MAX_THREADS"] = str(n_threads)
+
+
 def main():
     """Run all data processing steps in order."""
     print("=" * 80)
@@ -37,18 +49,37 @@ def main():
     print("=" * 80)
     print()
     
-    steps = [
-        ("Cleaning and merging ICE data", clean_and_merge),
+    # The geocoded removals are kept in memory so later steps reuse them
+    # instead of decoding unified_removals_with_geo.parquet again
+    shared = {}
+
+    def run_geocode():
+        shared["removals_geo"] = geocode_locations()
+
+    def run_aggregate():
+        removals_geo = shared.get("removals_geo")
+        aggregate_data(removals_geo.lazy() if removals_geo is not None else None)
+
+    first_step = ("Cleaning and merging ICE data", clean_and_merge)
+    # Run in this process while the workers run; aggregation reuses the
+    # in-memory geocoded frame, so it has to follow geocoding here
+    local_steps = [
         ("Creating migration data", create_migration_data),
-        ("Geocoding locations", geocode_locations),
-        ("Aggregating removal flows", aggregate_data),
+        ("Geocoding locations", run_geocode),
+        ("Aggregating removal flows", run_aggregate),
+    ]
+    # Independent of each other and of steps 2-4; they run in worker
+    # processes so each one gets its own interpreter and a share of the
+    # Polars thread pool
+    parallel_steps = [
         ("Creating Sankey diagram data", create_sankey_data),
         ("Creating timeline data", create_timeline_data),
         ("Creating detention journey data", create_detention_journey_data),
     ]
-    
-    for i, (step_name, step_func) in enumerate(steps, 1):
-        print(f"\n[{i}/{len(steps)}] {step_name}...")
+    total = 1 + len(local_steps) + len(parallel_steps)
+
+    def run_step(i, step_name, step_func):
+        print(f"\n[{i}/{total}] {step_name}...")
         print("-" * 80)
         try:
             step_func()
@@ -56,6 +87,34 @@ def main():
         except Exception as e:
             print(f"✗ Error in {step_name}: {e}")
             raise
+
+    # Builds the workbook caches the workers read, so it runs before them
+    run_step(1, *first_step)
+
+    # Split the cores between the workers and the steps that stay in this
+    # process; the cap is set only inside the workers, so this process and
+    # any later subprocess keep the default pool
+    workers = len(parallel_steps)
+    threads_per_step = max(1, (os.cpu_count() or 1) // (workers + 1))
+    first_parallel = 2 + len(local_steps)
+    print(f"\n[{first_parallel}-{total}/{total}] Starting remaining steps in parallel...")
+    print("-" * 80)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=limit_polars_threads,
+        initargs=(threads_per_step,),
+    ) as executor:
+        futures = [(name, executor.submit(func)) for name, func in parallel_steps]
+        for i, (step_name, step_func) in enumerate(local_steps, 2):
+            run_step(i, step_name, step_func)
+        for step_name, future in futures:
+            try:
+                future.result()
+                print(f"✓ {step_name} completed successfully")
+            except Exception as e:
+                print(f"✗ Error in {step_name}: {e}")
+                raise
     
     print("\n" + "=" * 80)
     print("ALL DATA PROCESSING STEPS COMPLETED SUCCESSFULLY!")
@@ -4,11 +4,26 @@ Creates flow_data.json and top_destinations.json for the removal flows map.
 """
 
 import polars as pl
-import json
+import orjson
 from pathlib import Path
 
 
-def aggregate_data():
+def place_name(col: str) -> pl.Expr:
+    """Title-cases a place name; null or empty names become "Unknown"."""
+    name = pl.col(col)
+    return (
+        pl.when(name.is_null() | (name == ""))
+        .then(pl.lit("Unknown"))
+        .otherwise(name.str.to_titlecase())
+    )
+
+
+def aggregate_data(removals_geo: pl.LazyFrame | None = None):
+    """
+    Aggregates geocoded removals into origin-destination flows.
+    Pass removals_geo to reuse an already loaded frame instead of scanning
+    unified_removals_with_geo.parquet again.
+    """
     script_dir = Path(__file__).parent.parent
     data_path = script_dir / "cleaned/unified_removals_with_geo.parquet"
     # Output to www/data for the frontend
@@ -16,81 +31,90 @@ def aggregate_data():
     output_path = output_dir / "flow_data.json"
     top_dest_path = output_dir / "top_destinations.json"
     
-    print(f"Loading data from {data_path}...")
-    df = pl.read_parquet(data_path)
+    if removals_geo is None:
+        print(f"Scanning data from {data_path}...")
+        removals_geo = pl.scan_parquet(data_path)
     
     # Filter for valid O-D pairs (lat/lon not null)
     # We use the columns created by geocode.py
     # Origin: Apprehension State -> apprehension_state_lat, apprehension_state_lon
     # Destination: Departure Country -> departure_country_lat, departure_country_lon
-    
-    valid_flow_df = df.filter(
-        pl.col("apprehension_state_lat").is_not_null() & 
-        pl.col("departure_country_lat").is_not_null()
-    )
-    
-    print(f"Valid records for flow: {len(valid_flow_df)}")
-    
+    #
     # Group by Origin and Destination
     # We include the coordinates in the group by to keep them in the result
     # (They should be unique per name anyway)
-    aggregated = valid_flow_df.group_by([
-        "Apprehension State", "apprehension_state_lat", "apprehension_state_lon",
-        "Departure Country", "departure_country_lat", "departure_country_lon"
-    ]).len().sort("len", descending=True)
+    #
+    # Kept lazy so the not-null filter and the column projection are pushed
+    # into the Parquet reader instead of materialising the filtered frame.
+    aggregated = (
+        removals_geo
+        .filter(
+            pl.col("apprehension_state_lat").is_not_null() & 
+            pl.col("departure_country_lat").is_not_null()
+        )
+        .group_by([
+            "Apprehension State", "apprehension_state_lat", "apprehension_state_lon",
+            "Departure Country", "departure_country_lat", "departure_country_lon"
+        ], maintain_order=False)  # sorted by count below, so input order is irrelevant
+        .len()
+        .sort("len", descending=True)
+        .collect(engine="streaming")
+    )
     
+    print(f"Valid records for flow: {aggregated['len'].sum()}")
     print(f"Unique Flows: {len(aggregated)}")
     
     # Prepare JSON structure
-    flows = []
     scale_factor = 100 # 1 particle = 100 people
     
-    for row in aggregated.iter_rows(named=True):
-        count = row["len"]
-        scaled_count = max(1, round(count / scale_factor)) # Ensure at least 1 particle if flow exists? Or maybe 0 if < 50?
-        # Let's say at least 1 if count > 0
-        
-        flow = {
-            "origin": {
-                "name": row["Apprehension State"].title() if row["Apprehension State"] else "Unknown",
-                "lat": row["apprehension_state_lat"],
-                "lon": row["apprehension_state_lon"]
-            },
-            "destination": {
-                "name": row["Departure Country"].title() if row["Departure Country"] else "Unknown",
-                "lat": row["departure_country_lat"],
-                "lon": row["departure_country_lon"]
-            },
-            "count": count,
-            "scaled_count": scaled_count
-        }
-        flows.append(flow)
+    # Build the nested records with Polars expressions instead of a Python loop.
+    # Every flow gets at least 1 particle.
+    flows = aggregated.select([
+        pl.struct([
+            place_name("Apprehension State").alias("name"),
+            pl.col("apprehension_state_lat").alias("lat"),
+            pl.col("apprehension_state_lon").alias("lon"),
+        ]).alias("origin"),
+        pl.struct([
+            place_name("Departure Country").alias("name"),
+            pl.col("departure_country_lat").alias("lat"),
+            pl.col("departure_country_lon").alias("lon"),
+        ]).alias("destination"),
+        pl.col("len").alias("count"),
+        (pl.col("len") / scale_factor).round().cast(pl.Int64).clip(lower_bound=1).alias("scaled_count"),
+    ])
     
     # Save to JSON
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    print(f"Saving {len(flows)} flows to {output_path}...")
-    with open(output_path, 'w') as f:
-        json.dump(flows, f, indent=2)
+    # Stream the array one record at a time so only a single flow dict is
+    # alive in Python at any point
+    print(f"Saving {flows.height} flows to {output_path}...")
+    with open(output_path, 'wb') as f:
+        f.write(b"[")
+        for i, flow in enumerate(flows.iter_rows(named=True)):
+            f.write(b",\n" if i else b"\n")
+            f.write(orjson.dumps(flow))
+        f.write(b"\n]\n")
     
     # Create top destinations summary
-    destination_totals = {}
-    for flow in flows:
-        dest_name = flow["destination"]["name"]
-        if dest_name not in destination_totals:
-            destination_totals[dest_name] = {
-                "name": dest_name,
-                "total": 0,
-                "lat": flow["destination"]["lat"],
-                "lon": flow["destination"]["lon"]
-            }
-        destination_totals[dest_name]["total"] += flow["count"]
-    
-    top_destinations = sorted(destination_totals.values(), key=lambda x: x["total"], reverse=True)[:10]
+    # Flows are sorted by count, so first() keeps the coordinates of the
+    # busiest flow into each destination
+    top_destinations = (
+        flows.select([pl.col("destination").struct.unnest(), "count"])
+        .group_by("name", maintain_order=True)
+        .agg([
+            pl.col("count").sum().alias("total"),
+            pl.col("lat").first(),
+            pl.col("lon").first(),
+        ])
+        .sort("total", descending=True, maintain_order=True)
+        .head(10)
+        .to_dicts()
+    )
     
     print(f"Saving top {len(top_destinations)} destinations to {top_dest_path}...")
-    with open(top_dest_path, 'w') as f:
-        json.dump({"destinations": top_destinations}, f, indent=2)
+    top_dest_path.write_bytes(orjson.dumps({"destinations": top_destinations}, option=orjson.OPT_INDENT_2))
     
     print("Done.")
 
@@ -4,27 +4,18 @@ Creates unified_removals.parquet in the cleaned/ directory.
 """
 
 import polars as pl
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from excel_cache import scan_excel
+
 
 def load_data(file_path):
     """
-    Loads Excel data using Polars with calamine engine.
-    Skips initial rows to find the correct header.
+    Returns a LazyFrame over an ICE workbook.
+    The sheet is read from its Parquet cache when the cache is current.
     """
-    print(f"Loading data from {file_path}...")
-    try:
-        # Based on exploration, header is at row index 6 (7th row)
-        df = pl.read_excel(
-            file_path,
-            read_options={"header_row": 6},
-            engine="calamine"
-        )
-        print(f"Successfully loaded {len(df)} rows.")
-        return df
-    except Exception as e:
-        print(f"Error loading {file_path}: {e}")
-        raise
+    return scan_excel(file_path)
 
 
 def clean_and_merge():
@@ -42,11 +33,14 @@ def clean_and_merge():
     removals_path = base_path / "2025-ICLI-00019_2024-ICFO-39357_ICE Removals_LESA-STU_FINAL Redacted_raw.xlsx"
     detentions_path = base_path / "2025-ICLI-00019_2024-ICFO-39357_ICE Detentions_LESA-STU_FINAL Redacted_raw.xlsx"
 
-    # Load datasets
+    # Load datasets lazily; nothing is materialised until the result is
+    # written to Parquet. On a cold cache the three workbooks are parsed
+    # concurrently; calamine releases the GIL while decoding.
     print("Starting data loading process...")
-    df_arrests = load_data(arrests_path)
-    df_removals = load_data(removals_path)
-    df_detentions = load_data(detentions_path)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        df_arrests, df_removals, df_detentions = executor.map(
+            load_data, [arrests_path, removals_path, detentions_path]
+        )
 
     # Prepare Arrests for merge (select relevant columns to avoid duplication)
     # We need Unique Identifier and Apprehension State from Arrests
@@ -56,54 +50,61 @@ def clean_and_merge():
         pl.col("Apprehension State").alias("Apprehension State_Arrests")
     ])
 
-    # Prepare Detentions for merge (just to check existence for now)
+    # Prepare Detentions for merge (just to check existence for now).
+    # Only the key is joined; the flag is read from whether it matched.
     detentions_subset = df_detentions.select([
-        pl.col("Unique Identifier")
-    ]).with_columns(pl.lit(True).alias("has_detention_record"))
+        pl.col("Unique Identifier").alias("Unique Identifier_Detentions")
+    ])
 
     print("Merging datasets...")
     
-    # Start with Removals
-    df_unified = df_removals
-
-    # Merge Arrests (Left Join)
-    df_unified = df_unified.join(
-        arrests_subset,
-        on="Unique Identifier",
-        how="left"
-    )
-
-    # Merge Detentions (Left Join)
-    df_unified = df_unified.join(
-        detentions_subset,
-        on="Unique Identifier",
-        how="left"
-    )
-
-    # Create flags
-    df_unified = df_unified.with_columns([
-        pl.col("Apprehension State_Arrests").is_not_null().alias("has_arrest_record"),
-        pl.col("has_detention_record").fill_null(False)
-    ])
-
-    # Fill Apprehension State in Removals from Arrests if missing
-    # If "Apprehension State" in Removals is null, take "Apprehension State_Arrests"
-    df_unified = df_unified.with_columns(
-        pl.col("Apprehension State").fill_null(pl.col("Apprehension State_Arrests"))
+    # Start with Removals, merge Arrests and Detentions (Left Joins), then
+    # derive the flags and fill the state in one projection. The joins keep
+    # the removals row order, which the streaming sink would not guarantee.
+    df_unified = (
+        df_removals
+        .join(arrests_subset, on="Unique Identifier", how="left", maintain_order="left")
+        .join(
+            detentions_subset,
+            left_on="Unique Identifier",
+            right_on="Unique Identifier_Detentions",
+            how="left",
+            maintain_order="left",
+            coalesce=False,
+        )
+        .with_columns([
+            # Create flags
+            pl.col("Unique Identifier_Detentions").is_not_null().alias("has_detention_record"),
+            pl.col("Apprehension State_Arrests").is_not_null().alias("has_arrest_record"),
+            # Fill Apprehension State in Removals from Arrests if missing
+            pl.coalesce([pl.col("Apprehension State"), pl.col("Apprehension State_Arrests")])
+            .alias("Apprehension State"),
+        ])
+        # Drop the temporary columns
+        .drop(["Apprehension State_Arrests", "Unique Identifier_Detentions"])
     )
 
-    # Drop the temporary column
-    df_unified = df_unified.drop("Apprehension State_Arrests")
-
-    print(f"Unified dataset has {len(df_unified)} rows.")
-
     # Save to Parquet
     output_dir = script_dir / "cleaned"
     output_dir.mkdir(parents=True, exist_ok=True)
     output_path = output_dir / "unified_removals.parquet"
     
     print(f"Saving unified data to {output_path}...")
-    df_unified.write_parquet(output_path)
+    # zstd level 3 keeps the file small at little write cost; Polars
+    # dictionary-encodes the low-cardinality string columns by default
+    df_unified.sink_parquet(
+        output_path,
+        compression="zstd",
+        compression_level=3,
+        row_group_size=500_000,
+        statistics=True,
+        # Process the joins in bounded-memory batches so removals larger
+        # than RAM still merge
+        engine="streaming",
+    )
+    # The row count comes from the Parquet footer, not from the data
+    row_count = pl.scan_parquet(output_path).select(pl.len()).collect().item()
+    print(f"Unified dataset has {row_count} rows.")
     print("Done.")
 
 
@@ -3,9 +3,34 @@ Extract migration data from MPI Excel file for visualization.
 Creates migration_data.json in the www/data/ directory.
 """
 
-import polars as pl
+from openpyxl import load_workbook
 from pathlib import Path
-import json
+import orjson
+import re
+
+
+NON_DIGITS = re.compile(r"[^0-9]")
+
+
+def parse_int(value):
+    """
+    Keeps only the digits of a cell, e.g. "2,244,602" -> 2244602.
+    Returns None when the cell has no digits.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    digits = NON_DIGITS.sub("", str(value)) if value is not None else ""
+    return int(digits) if digits else None
+
+
+def parse_float(value):
+    """
+    Parses a numeric cell, returning None when it is not a number.
+    """
+    try:
+        return float(str(value).strip()) if value is not None else None
+    except ValueError:
+        return None
 
 
 def create_migration_data():
@@ -19,37 +44,9 @@ def create_migration_data():
     print(f"Loading MPI migration data from {mpi_path}...")
     
     try:
-        # Read the MPI Excel file
-        df = pl.read_excel(mpi_path, engine="calamine")
-        col_year, col_pop, col_pct = df.columns
-
-        # Clean and convert; drop the header row by keeping numeric years
-        clean = (
-            df.rename({col_year: "year", col_pop: "population", col_pct: "percentage"})
-            .with_columns(
-                [
-                    pl.col("year")
-                    .cast(pl.Utf8)
-                    .str.replace_all(r"[^0-9]", "")
-                    .cast(pl.Int64, strict=False)
-                    .alias("year"),
-                    pl.col("population")
-                    .cast(pl.Utf8)
-                    .str.replace_all(r"[^0-9]", "")
-                    .cast(pl.Int64, strict=False)
-                    .alias("population"),
-                    pl.col("percentage")
-                    .cast(pl.Utf8)
-                    .str.strip_chars()
-                    .cast(pl.Float64, strict=False)
-                    .alias("percentage"),
-                ]
-            )
-            .filter(pl.col("year").is_not_null())
-        )
-
         # Target years (Excel up to 2023) + manual 2024 point
         targets = [1850, 1960, 2010, 2023]
+
         colors = {
             1850: "#edbe62",
             1960: "#087e8b",
@@ -62,23 +59,31 @@ def create_migration_data():
         def icon_count(pop):
             return int((pop + 199_999) // 200_000)
 
-        filtered = clean.filter(pl.col("year").is_in(targets)).to_dicts()
-        print(f"Filtered rows count: {len(filtered)}")
-
-        migration_data = []
-        for row in filtered:
-            year = int(row["year"])
-            pop = int(row["population"])
-            pct = float(row["percentage"])
-            migration_data.append(
-                {
-                    "year": year,
-                    "population": pop,
-                    "percentage": pct,
-                    "iconCount": icon_count(pop),
-                    "color": colors.get(year, "#ccc"),
-                }
-            )
+        # The sheet is a few hundred cells and only four rows are kept, so
+        # read it row by row instead of building a DataFrame, and build each
+        # output record as its row is read. The first row is the header;
+        # year, population and percentage are the first three columns.
+        wb = load_workbook(mpi_path, read_only=True, data_only=True)
+        try:
+            migration_data = []
+            for year_cell, pop_cell, pct_cell in wb.worksheets[0].iter_rows(min_row=2, max_col=3, values_only=True):
+                year = parse_int(year_cell)
+                if year not in targets:
+                    continue
+                pop = parse_int(pop_cell)
+                migration_data.append(
+                    {
+                        "year": year,
+                        "population": pop,
+                        "percentage": parse_float(pct_cell),
+                        "iconCount": icon_count(pop),
+                        "color": colors.get(year, "#ccc"),
+                    }
+                )
+        finally:
+            wb.close()
+
+        print(f"Filtered rows count: {len(migration_data)}")
 
         # Manually append 2024 point (not in Excel)
         migration_data.append(
@@ -100,8 +105,7 @@ def create_migration_data():
         output_path = output_dir / "migration_data.json"
         
         print(f"Saving migration data to {output_path}...")
-        with open(output_path, 'w') as f:
-            json.dump(migration_data, f, indent=2)
+        output_path.write_bytes(orjson.dumps(migration_data, option=orjson.OPT_INDENT_2))
         
         print("Migration data saved successfully!")
         print(f"Created data for {len(migration_data)} time periods")
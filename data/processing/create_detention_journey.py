@@ -11,11 +11,48 @@ This script:
 6. Generates JSON files for the visualization
 """
 
+import heapq
 import polars as pl
-import json
+import orjson
 from pathlib import Path
 from datetime import datetime
 
+from excel_cache import scan_excel
+from run_manifest import input_manifest, outputs_current, write_manifest
+
+
+EARTH_RADIUS_KM = 6371
+KM_TO_MILES = 0.621371
+
+
+def haversine_km(lon1, lat1, lon2, lat2):
+    """
+    Great circle distance in kilometers between two points, as a Polars
+    expression over coordinate expressions in degrees.
+    """
+    lon1, lat1, lon2, lat2 = (e.radians() for e in (lon1, lat1, lon2, lat2))
+    a = ((lat2 - lat1) / 2).sin() ** 2 + lat1.cos() * lat2.cos() * ((lon2 - lon1) / 2).sin() ** 2
+    return 2 * EARTH_RADIUS_KM * a.sqrt().arcsin()
+
+
+def distances_km(origins, destinations):
+    """
+    Distances in kilometers between paired points (dicts with "lon" and
+    "lat"), computed in one vectorized pass.
+    """
+    coords = pl.DataFrame(
+        {
+            "lon1": [p["lon"] for p in origins],
+            "lat1": [p["lat"] for p in origins],
+            "lon2": [p["lon"] for p in destinations],
+            "lat2": [p["lat"] for p in destinations],
+        },
+        schema=dict.fromkeys(["lon1", "lat1", "lon2", "lat2"], pl.Float64),
+    )
+    return coords.select(
+        haversine_km(pl.col("lon1"), pl.col("lat1"), pl.col("lon2"), pl.col("lat2"))
+    ).to_series().to_list()
+
 
 def create_detention_journey_data():
     """
@@ -45,157 +82,199 @@ def create_detention_journey_data():
     OUTPUT_FLOWS = WWW_DATA_DIR / "detention_flows.json"
     OUTPUT_HIGHLIGHTS = WWW_DATA_DIR / "detention_highlights.json"
     OUTPUT_STATISTICS = WWW_DATA_DIR / "detention_statistics.json"
+    MANIFEST_PATH = CLEANED_DIR / "detention_journey_manifest.json"
 
-    # 1. Load detentions data
-    print(f"\n1. Loading detentions data from {DETENTIONS_PATH.name}...")
-    df_detentions = pl.read_excel(
-    DETENTIONS_PATH,
-    engine="calamine",
-    read_options={"header_row": 6}
-    )
-    print(f"   Loaded {df_detentions.shape[0]:,} detention records")
-    print(f"   Columns: {len(df_detentions.columns)}")
+    # The outputs depend only on the two inputs, this script and the
+    # workbook cache, so the run is skipped when none of them changed since
+    # the outputs were written
+    manifest = input_manifest([DETENTIONS_PATH, FACILITIES_PATH, Path(__file__)])
+    if outputs_current(MANIFEST_PATH, manifest, [OUTPUT_FLOWS, OUTPUT_HIGHLIGHTS, OUTPUT_STATISTICS]):
+        print(f"\nInputs unchanged since the last run; keeping the files in {WWW_DATA_DIR}")
+        return
 
-    # 2. Load facilities data
-    print(f"\n2. Loading facilities data from {FACILITIES_PATH.name}...")
-    df_facilities = pl.read_csv(FACILITIES_PATH)
-    print(f"   Loaded {df_facilities.shape[0]:,} facilities")
+    # Steps 1-7 are built as one lazy plan over the Parquet cache and run
+    # by a single collect_all, so the shared scan, filters and join are
+    # computed once and the not-null filters are pushed below the join
 
-    # 3. Select and prepare detention columns
-    print("\n3. Preparing detention data...")
-    df_detentions = df_detentions.select([
+    # 1. Load detentions data
+    # Only the columns used below are decoded from the Parquet cache, and
+    # the stay dates are renamed in the same projection
+    lf_sheet = scan_excel(DETENTIONS_PATH)
+    lf_detentions = lf_sheet.select([
     "Unique Identifier",
     "Detention Facility Code",
-    "Stay Book In Date Time",
-    "Stay Book Out Date Time",
+    pl.col("Stay Book In Date Time").alias("book_in_date"),
+    pl.col("Stay Book Out Date Time").alias("book_out_date"),
     "Gender",
     "Birth Year",
     "Citizenship Country",
     "Ethnicity",
-    ]).filter(
-    pl.col("Unique Identifier").is_not_null() &
-    pl.col("Detention Facility Code").is_not_null()
-    )
+    ])
 
-    # Parse dates (they may already be datetime type from Excel)
-    try:
-        df_detentions = df_detentions.with_columns([
-            pl.col("Stay Book In Date Time").cast(pl.Datetime).alias("book_in_date"),
-            pl.col("Stay Book Out Date Time").cast(pl.Datetime).alias("book_out_date"),
-        ])
-    except Exception:
-        # If already datetime, just rename
-        df_detentions = df_detentions.with_columns([
-            pl.col("Stay Book In Date Time").alias("book_in_date"),
-            pl.col("Stay Book Out Date Time").alias("book_out_date"),
-        ])
+    # 2. Load facilities data (small, and reused for the Chicago statistics)
+    df_facilities = pl.read_csv(FACILITIES_PATH)
 
-    # Filter out records with missing book in dates
-    df_detentions = df_detentions.filter(pl.col("book_in_date").is_not_null())
-    print(f"   After filtering: {df_detentions.shape[0]:,} records with valid data")
+    # 3. Prepare detention data: drop rows without an identifier, facility
+    # or book in date. Dates are cast in case Excel stored them as text.
+    # All three checks run as one predicate after the cast.
+    lf_valid = lf_detentions.with_columns(
+        pl.col(["book_in_date", "book_out_date"]).cast(pl.Datetime)
+    ).filter(
+    pl.col("Unique Identifier").is_not_null() &
+    pl.col("Detention Facility Code").is_not_null() &
+    pl.col("book_in_date").is_not_null()
+    )
 
     # 4. Join with facilities
-    print("\n4. Joining detentions with facilities...")
-    df_joined = df_detentions.join(
-        df_facilities,
+    lf_joined = lf_valid.join(
+        df_facilities.lazy(),
         left_on="Detention Facility Code",
         right_on="detention_facility_code",
         how="left"
     )
 
     # Check for missing facility matches
-    missing_facilities = df_joined.filter(pl.col("latitude").is_null())
-    print(f"   Warning: {missing_facilities.shape[0]:,} records missing facility coordinates")
-    if missing_facilities.shape[0] > 0:
-        missing_codes = missing_facilities.select("Detention Facility Code").unique()
-        print(f"   Missing facility codes (first 10): {missing_codes.head(10).to_series().to_list()}")
+    lf_missing = lf_joined.filter(pl.col("latitude").is_null()).select([
+        pl.len().alias("count"),
+        pl.col("Detention Facility Code").unique().head(10).implode().alias("codes"),
+    ])
 
     # Filter to only records with valid coordinates
-    df_joined = df_joined.filter(
+    lf_located = lf_joined.filter(
     pl.col("latitude").is_not_null() &
     pl.col("longitude").is_not_null()
     )
-    print(f"   After filtering: {df_joined.shape[0]:,} records with coordinates")
 
     # 5. Count detentions per individual
-    print("\n5. Analyzing transfer patterns...")
-    transfer_counts = df_joined.group_by("Unique Identifier").agg([
+    transfer_counts = lf_located.group_by("Unique Identifier").agg([
     pl.col("Detention Facility Code").n_unique().alias("unique_facilities"),
-    pl.count().alias("detention_count")
-    ]).sort("unique_facilities", descending=True)
+    pl.len().alias("detention_count")
+    ])
 
-    print(f"   Total unique individuals: {transfer_counts.shape[0]:,}")
-    print(f"   Individuals with 2+ detentions: {transfer_counts.filter(pl.col('detention_count') >= 2).shape[0]:,}")
-    print(f"   Individuals with 2+ facilities: {transfer_counts.filter(pl.col('unique_facilities') >= 2).shape[0]:,}")
+    # Compute the summary counts in one select instead of a filter per count
+    lf_summary = transfer_counts.select([
+    pl.len().alias("individuals"),
+    (pl.col("detention_count") >= 2).sum().alias("multi_detention"),
+    (pl.col("unique_facilities") >= 2).sum().alias("multi_facility"),
+    ])
 
     # 6. Filter for individuals with 2+ detentions (actual transfers)
-    print("\n6. Filtering for individuals with 2+ detentions...")
     individuals_with_transfers = transfer_counts.filter(
     pl.col("detention_count") >= 2
     ).select("Unique Identifier")
 
-    df_transfers = df_joined.join(
+    # 7. Sort chronologically for each individual. The sort flags the
+    # identifier column as sorted, and the group_by and over() below rely on
+    # this order, so no per-individual re-sort is needed.
+    lf_transfers = lf_located.join(
     individuals_with_transfers,
     on="Unique Identifier",
-    how="inner"
-    )
+    how="semi"
+    ).sort(["Unique Identifier", "book_in_date"])
+
+    print(f"\n1. Loading detentions data from {DETENTIONS_PATH.name}...")
+    loaded, valid, missing, located, summary, df_transfers = pl.collect_all([
+        lf_detentions.select(pl.len()),
+        lf_valid.select(pl.len()),
+        lf_missing,
+        lf_located.select(pl.len()),
+        lf_summary,
+        lf_transfers,
+    # Run the join and group_bys in bounded-memory batches; the thread
+    # count comes from POLARS_MAX_THREADS, which main_clean sets per worker
+    ], engine="streaming")
+    missing = missing.row(0, named=True)
+    summary = summary.row(0, named=True)
+    valid_count = valid.item()
+
+    print(f"   Loaded {loaded.item():,} detention records")
+    # Width of the whole sheet, read from the cache schema without decoding
+    print(f"   Columns: {len(lf_sheet.collect_schema())}")
+
+    print(f"\n2. Loading facilities data from {FACILITIES_PATH.name}...")
+    print(f"   Loaded {df_facilities.shape[0]:,} facilities")
+
+    print("\n3. Preparing detention data...")
+    print(f"   After filtering: {valid_count:,} records with valid data")
+
+    print("\n4. Joining detentions with facilities...")
+    print(f"   Warning: {missing['count']:,} records missing facility coordinates")
+    if missing["count"] > 0:
+        print(f"   Missing facility codes (first 10): {missing['codes']}")
+    print(f"   After filtering: {located.item():,} records with coordinates")
+
+    print("\n5. Analyzing transfer patterns...")
+    print(f"   Total unique individuals: {summary['individuals']:,}")
+    print(f"   Individuals with 2+ detentions: {summary['multi_detention']:,}")
+    print(f"   Individuals with 2+ facilities: {summary['multi_facility']:,}")
+
+    print("\n6. Filtering for individuals with 2+ detentions...")
     print(f"   Filtered to {df_transfers.shape[0]:,} detention records")
-    print(f"   Representing {individuals_with_transfers.shape[0]:,} individuals")
+    print(f"   Representing {summary['multi_detention']:,} individuals")
 
-    # 7. Sort chronologically for each individual
     print("\n7. Creating chronologically ordered paths...")
-    df_transfers = df_transfers.sort(["Unique Identifier", "book_in_date"])
 
     # 8. Build paths for each individual
     print("\n8. Building journey paths...")
-    paths_data = []
 
-    # Group by individual
-    grouped = df_transfers.group_by("Unique Identifier")
+    # isoformat() drops the fraction when it is zero
+    book_in = pl.col("book_in_date")
+    iso_date = (
+        pl.when(book_in.dt.microsecond() == 0)
+        .then(book_in.dt.strftime("%Y-%m-%dT%H:%M:%S"))
+        .otherwise(book_in.dt.strftime("%Y-%m-%dT%H:%M:%S%.6f"))
+    )
 
-    for unique_id, group_df in grouped:
-        # Extract the actual ID value
-        id_value = unique_id[0] if isinstance(unique_id, tuple) else unique_id
-        
-        # Skip empty or null unique identifiers
-        if not id_value or id_value == "" or str(id_value).strip() == "":
-            continue
-        
-        # Sort by date (should already be sorted but ensure it)
-        group_df = group_df.sort("book_in_date")
-        
-        path = []
-        for row in group_df.iter_rows(named=True):
-            path.append({
-                "facility_code": row["Detention Facility Code"],
-                "facility_name": row["detention_facility_name"],
-                "lat": float(row["latitude"]),
-                "lon": float(row["longitude"]),
-                "city": row["city"],
-                "state": row["state"],
-                "date": row["book_in_date"].isoformat() if row["book_in_date"] else None,
-            })
-    
-    # Store the path data
-    paths_data.append({
-        "unique_id": id_value,
-        "path": path,
-        "transfer_count": len(path),
-        "unique_facilities": len(set(p["facility_code"] for p in path)),
-        # Store demographic info for potential use
-        "gender": group_df["Gender"][0] if group_df.shape[0] > 0 else None,
-        "birth_year": int(group_df["Birth Year"][0]) if group_df.shape[0] > 0 and group_df["Birth Year"][0] is not None else None,
-        "citizenship": group_df["Citizenship Country"][0] if group_df.shape[0] > 0 else None,
-    })
+    # Facility fields shared by path steps and flow endpoints
+    facility_fields = [
+        pl.col("Detention Facility Code").alias("facility_code"),
+        pl.col("detention_facility_name").alias("facility_name"),
+        pl.col("latitude").cast(pl.Float64).alias("lat"),
+        pl.col("longitude").cast(pl.Float64).alias("lon"),
+        pl.col("city"),
+        pl.col("state"),
+    ]
+
+    # Skip empty or null unique identifiers
+    df_paths = df_transfers.filter(
+        pl.col("Unique Identifier").cast(pl.String).str.strip_chars().fill_null("") != ""
+    )
+
+    # One aggregation builds every path; rows are already in date order
+    # within each individual, and group_by keeps that order
+    paths_data = (
+        df_paths
+        .group_by("Unique Identifier", maintain_order=True)
+        .agg([
+            pl.struct([*facility_fields, iso_date.alias("date")]).alias("path"),
+            pl.len().alias("transfer_count"),
+            pl.col("Detention Facility Code").n_unique().alias("unique_facilities"),
+            # Distance along the path, from each stop to the next, computed
+            # on the coordinate columns rather than the path dicts
+            haversine_km(
+                pl.col("longitude").cast(pl.Float64),
+                pl.col("latitude").cast(pl.Float64),
+                pl.col("longitude").cast(pl.Float64).shift(-1),
+                pl.col("latitude").cast(pl.Float64).shift(-1),
+            ).sum().alias("total_distance_km"),
+            # Store demographic info for potential use
+            pl.col("Gender").first().alias("gender"),
+            pl.col("Birth Year").first().cast(pl.Int64).alias("birth_year"),
+            pl.col("Citizenship Country").first().alias("citizenship"),
+        ])
+        .rename({"Unique Identifier": "unique_id"})
+        .to_dicts()
+    )
 
     print(f"   Created {len(paths_data)} journey paths")
 
     # 9. Identify top individuals with most transfers
     print("\n9. Identifying individuals with most transfers...")
-    paths_data_sorted = sorted(paths_data, key=lambda x: x["unique_facilities"], reverse=True)
+    # Only the top 10 are used, so keep those instead of sorting every path
+    paths_data_sorted = heapq.nlargest(10, paths_data, key=lambda x: x["unique_facilities"])
 
     print(f"   Top 10 individuals by unique facilities:")
-    for i, person in enumerate(paths_data_sorted[:10], 1):
+    for i, person in enumerate(paths_data_sorted, 1):
         print(f"   {i}. ID: {person['unique_id'][:20]}... - {person['unique_facilities']} facilities, {person['transfer_count']} detentions")
 
     # Get top 2 for highlights
@@ -204,48 +283,52 @@ def create_detention_journey_data():
     # 10. Prepare output data - Aggregate flows by facility pairs
     print("\n10. Aggregating flows by facility pairs...")
 
-    # Aggregate all segments into origin-destination pairs with counts
-    flow_aggregates = {}
-    for person in paths_data:
-        path = person["path"]
-        for i in range(len(path) - 1):
-            origin = path[i]["facility_code"]
-            dest = path[i + 1]["facility_code"]
-            
-            if origin == dest:
-                continue
-                
-            # Create a unique key for this facility pair
-            pair_key = f"{origin}->{dest}"
-            
-            if pair_key not in flow_aggregates:
-                flow_aggregates[pair_key] = {
-                    "origin": {
-                        "facility_code": path[i]["facility_code"],
-                        "facility_name": path[i]["facility_name"],
-                        "lat": path[i]["lat"],
-                        "lon": path[i]["lon"],
-                        "city": path[i]["city"],
-                        "state": path[i]["state"],
-                    },
-                    "destination": {
-                        "facility_code": path[i + 1]["facility_code"],
-                        "facility_name": path[i + 1]["facility_name"],
-                        "lat": path[i + 1]["lat"],
-                        "lon": path[i + 1]["lon"],
-                        "city": path[i + 1]["city"],
-                        "state": path[i + 1]["state"],
-                    },
-                    "count": 0
-                }
-            
-            flow_aggregates[pair_key]["count"] += 1
-
-    print(f"   Aggregated to {len(flow_aggregates)} unique facility-pair flows")
-
-    # Convert to list and sort by count
-    aggregated_flows = list(flow_aggregates.values())
-    aggregated_flows.sort(key=lambda x: x["count"], reverse=True)
+    # Each stop is paired with the next stop of the same individual
+    segments = (
+        df_paths
+        .select([
+            pl.col("Unique Identifier"),
+            pl.struct(facility_fields).alias("origin"),
+        ])
+        .with_columns(pl.col("origin").shift(-1).over("Unique Identifier").alias("destination"))
+        .filter(pl.col("destination").is_not_null())
+    )
+
+    # Aggregate all segments into origin-destination pairs with counts.
+    # Pairs keep the order they are first seen in, so ties in count sort
+    # the same way as before.
+    flows_df = (
+        segments
+        .filter(
+            pl.col("origin").struct.field("facility_code") != pl.col("destination").struct.field("facility_code")
+        )
+        .group_by([
+            pl.col("origin").struct.field("facility_code").alias("origin_code"),
+            pl.col("destination").struct.field("facility_code").alias("destination_code"),
+        ], maintain_order=True)
+        .agg([
+            pl.col("origin").first(),
+            pl.col("destination").first(),
+            pl.len().alias("count"),
+        ])
+        .sort("count", descending=True, maintain_order=True)
+        .select(["origin", "destination", "count"])
+        # Scale particle counts (max 5 particles per flow, min 1) as a
+        # column cast instead of a per-flow int() in Python
+        .with_columns(
+            pl.when(pl.col("count").max() > pl.col("count").min())
+            .then(
+                ((pl.col("count") - pl.col("count").min())
+                 / (pl.col("count").max() - pl.col("count").min()) * 4)
+                .floor().cast(pl.Int64) + 1
+            )
+            .otherwise(1)
+            .alias("scaled_count")
+        )
+    )
+    aggregated_flows = flows_df.to_dicts()
+
+    print(f"   Aggregated to {len(aggregated_flows)} unique facility-pair flows")
 
     # Calculate scaled counts for visualization (similar to removals map)
     max_count = aggregated_flows[0]["count"] if aggregated_flows else 1
@@ -256,44 +339,15 @@ def create_detention_journey_data():
     for i, flow in enumerate(aggregated_flows[:5], 1):
         print(f"   {i}. {flow['origin']['facility_name']} → {flow['destination']['facility_name']}: {flow['count']} transfers")
 
-    # Scale particle counts (max 5 particles per flow, min 1)
-    for flow in aggregated_flows:
-        if max_count > min_count:
-            normalized = (flow["count"] - min_count) / (max_count - min_count)
-            flow["scaled_count"] = max(1, int(normalized * 4) + 1)  # 1 to 5 particles
-        else:
-            flow["scaled_count"] = 1
-
     flows_output = {
     "flows": aggregated_flows,
     "total_segments": sum(f["count"] for f in aggregated_flows),
     "unique_routes": len(aggregated_flows),
     }
 
-    # Calculate total distance for highlighted individuals (before creating highlights output)
-    # Import haversine function here since it's defined later
-    from math import radians, cos, sin, asin, sqrt
-
-    def haversine_distance_early(lon1, lat1, lon2, lat2):
-        """Calculate the great circle distance in kilometers between two points"""
-        lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a))
-        km = 6371 * c
-        return km
-
-    # Calculate total distance for highlighted individuals
+    # Total distance for highlighted individuals (km summed per path above)
     for person in top_2:
-        total_dist_km = 0
-        path = person["path"]
-        for i in range(len(path) - 1):
-            dist = haversine_distance_early(path[i]["lon"], path[i]["lat"], path[i + 1]["lon"], path[i + 1]["lat"])
-            total_dist_km += dist
-        
-        person["total_distance_km"] = total_dist_km
-        person["total_distance_miles"] = total_dist_km * 0.621371
+        person["total_distance_miles"] = person["total_distance_km"] * KM_TO_MILES
 
     # Highlights data with full demographic info
     highlights_output = {
@@ -325,30 +379,19 @@ def create_detention_journey_data():
     # 11. Calculate distances and location statistics
     print("\n11. Calculating distances and location statistics...")
 
-    from math import radians, cos, sin, asin, sqrt
-
-    def haversine_distance(lon1, lat1, lon2, lat2):
-        """Calculate the great circle distance in kilometers between two points"""
-        lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a))
-        km = 6371 * c
-        return km
-
     # Calculate distances for all flows
+    flow_distances = distances_km(
+        [flow["origin"] for flow in aggregated_flows],
+        [flow["destination"] for flow in aggregated_flows],
+    )
     total_distance_km = 0
-    for flow in aggregated_flows:
-        origin = flow["origin"]
-        dest = flow["destination"]
-        distance_km = haversine_distance(origin["lon"], origin["lat"], dest["lon"], dest["lat"])
+    for flow, distance_km in zip(aggregated_flows, flow_distances):
         flow["distance_km"] = distance_km
-        flow["distance_miles"] = distance_km * 0.621371
+        flow["distance_miles"] = distance_km * KM_TO_MILES
         total_distance_km += distance_km * flow["count"]
 
     avg_distance_km = total_distance_km / flows_output["total_segments"] if flows_output["total_segments"] > 0 else 0
-    avg_distance_miles = avg_distance_km * 0.621371
+    avg_distance_miles = avg_distance_km * KM_TO_MILES
 
     print(f"   Average transfer distance: {avg_distance_km:.1f} km ({avg_distance_miles:.1f} miles)")
 
@@ -356,182 +399,150 @@ def create_detention_journey_data():
     chicago_lat, chicago_lon = 41.8781, -87.6298
     chicago_radius_km = 100
 
-    chicago_facilities = []
-    for facility in df_facilities.iter_rows(named=True):
-        if facility["latitude"] and facility["longitude"]:
-            dist_to_chicago = haversine_distance(facility["longitude"], facility["latitude"], chicago_lon, chicago_lat)
-            if dist_to_chicago <= chicago_radius_km:
-                chicago_facilities.append({
-                    "code": facility["detention_facility_code"],
-                    "name": facility["detention_facility_name"],
-                    "lat": facility["latitude"],
-                    "lon": facility["longitude"],
-                    "city": facility["city"],
-                    "state": facility["state"],
-                    "distance_to_chicago": dist_to_chicago
-                })
+    chicago_df = (
+        df_facilities
+        .filter(pl.col("latitude").is_not_null() & pl.col("longitude").is_not_null())
+        .with_columns(
+            haversine_km(
+                pl.col("longitude"), pl.col("latitude"), pl.lit(chicago_lon), pl.lit(chicago_lat)
+            ).alias("distance_to_chicago")
+        )
+        .filter(pl.col("distance_to_chicago") <= chicago_radius_km)
+        .select([
+            pl.col("detention_facility_code").alias("code"),
+            pl.col("detention_facility_name").alias("name"),
+            pl.col("latitude").alias("lat"),
+            pl.col("longitude").alias("lon"),
+            "city",
+            "state",
+            "distance_to_chicago",
+        ])
+    )
+    chicago_facilities = chicago_df.to_dicts()
 
     print(f"   Found {len(chicago_facilities)} facilities near Chicago")
 
-    # Calculate statistics for Chicago area
-    chicago_outflows = 0
-    chicago_inflows = 0
-    chicago_destinations = {}
-    chicago_origins = {}
-
-    for person in paths_data:
-        path = person["path"]
-        for i in range(len(path) - 1):
-            origin_code = path[i]["facility_code"]
-            dest_code = path[i + 1]["facility_code"]
-            
-            # Check if origin is in Chicago area (outflows)
-            if any(f["code"] == origin_code for f in chicago_facilities):
-                chicago_outflows += 1
-                dest_name = path[i + 1]["facility_name"]
-                dest_key = f"{dest_code}|{dest_name}"
-                
-                if dest_key not in chicago_destinations:
-                    chicago_destinations[dest_key] = {
-                        "code": dest_code,
-                        "name": dest_name,
-                        "lat": path[i + 1]["lat"],
-                        "lon": path[i + 1]["lon"],
-                        "count": 0
-                    }
-                chicago_destinations[dest_key]["count"] += 1
-            
-            # Check if destination is in Chicago area (inflows)
-            if any(f["code"] == dest_code for f in chicago_facilities):
-                chicago_inflows += 1
-                origin_name = path[i]["facility_name"]
-                origin_key = f"{origin_code}|{origin_name}"
-                
-                if origin_key not in chicago_origins:
-                    chicago_origins[origin_key] = {
-                        "code": origin_code,
-                        "name": origin_name,
-                        "lat": path[i]["lat"],
-                        "lon": path[i]["lon"],
-                        "count": 0
-                    }
-                chicago_origins[origin_key]["count"] += 1
-
-    # Get top 5 Chicago destinations (outflows)
-    chicago_top_dests = sorted(chicago_destinations.values(), key=lambda x: x["count"], reverse=True)[:5]
-    for dest in chicago_top_dests:
-        # Calculate distance from Chicago
-        if chicago_facilities:
-            avg_chicago_lat = sum(f["lat"] for f in chicago_facilities) / len(chicago_facilities)
-            avg_chicago_lon = sum(f["lon"] for f in chicago_facilities) / len(chicago_facilities)
-            dest["distance_km"] = haversine_distance(avg_chicago_lon, avg_chicago_lat, dest["lon"], dest["lat"])
-            dest["distance_miles"] = dest["distance_km"] * 0.621371
-
-    # Get top 5 Chicago origins (inflows)
-    chicago_top_origins = sorted(chicago_origins.values(), key=lambda x: x["count"], reverse=True)[:5]
-    for origin in chicago_top_origins:
-        # Calculate distance from Chicago
-        if chicago_facilities:
-            avg_chicago_lat = sum(f["lat"] for f in chicago_facilities) / len(chicago_facilities)
-            avg_chicago_lon = sum(f["lon"] for f in chicago_facilities) / len(chicago_facilities)
-            origin["distance_km"] = haversine_distance(avg_chicago_lon, avg_chicago_lat, origin["lon"], origin["lat"])
-            origin["distance_miles"] = origin["distance_km"] * 0.621371
+    # Calculate statistics for Chicago area. Every segment counts, including
+    # stays that continue at the same facility.
+    chicago_codes = chicago_df["code"].cast(pl.String)
+
+    def chicago_links(end, other):
+        """
+        Segments whose `end` is a Chicago-area facility, with the top 5
+        facilities at the `other` end by segment count.
+        """
+        linked = segments.filter(pl.col(end).struct.field("facility_code").is_in(chicago_codes.implode()))
+        top = (
+            linked
+            .select(pl.col(other).struct.unnest())
+            .group_by(["facility_code", "facility_name"], maintain_order=True)
+            .agg([
+                pl.col("lat").first(),
+                pl.col("lon").first(),
+                pl.len().alias("count"),
+            ])
+            .sort("count", descending=True, maintain_order=True)
+            .head(5)
+            .select([
+                pl.col("facility_code").alias("code"),
+                pl.col("facility_name").alias("name"),
+                "lat",
+                "lon",
+                "count",
+            ])
+            .to_dicts()
+        )
+        return linked.height, top
+
+    # Get top 5 Chicago destinations (outflows) and origins (inflows)
+    chicago_outflows, chicago_top_dests = chicago_links("origin", "destination")
+    chicago_inflows, chicago_top_origins = chicago_links("destination", "origin")
+
+    # Calculate distance from the center of the Chicago facilities
+    if chicago_facilities:
+        chicago_center = chicago_df.select(pl.col(["lat", "lon"]).mean()).row(0, named=True)
+        for places in [chicago_top_dests, chicago_top_origins]:
+            for place, distance_km in zip(places, distances_km([chicago_center] * len(places), places)):
+                place["distance_km"] = distance_km
+                place["distance_miles"] = distance_km * KM_TO_MILES
 
     print(f"   Chicago area: {chicago_outflows} outflows, {chicago_inflows} inflows")
     if chicago_top_dests:
         print(f"   Top Chicago destination: {chicago_top_dests[0]['name']} ({chicago_top_dests[0]['count']} transfers)")
 
-    # Find top 2 busiest facilities (excluding Chicago area codes)
-    chicago_codes = {f["code"] for f in chicago_facilities}
-    facility_transfer_counts = {}
+    # Find top 2 busiest facilities (excluding Chicago area codes).
+    # Every flow counts as an outflow of its origin and an inflow of its
+    # destination; ends are ordered by flow rank (origin before destination)
+    # so ties in the total keep the order facilities first appear in.
+    ranked_flows = flows_df.with_row_index("rank")
+    no_flows = pl.lit(0, pl.UInt32)
+    flow_ends = pl.concat([
+        ranked_flows.select([
+            "rank", pl.lit(0).alias("side"), pl.col("origin").alias("facility"),
+            pl.col("count").alias("outflows"), no_flows.alias("inflows"),
+        ]),
+        ranked_flows.select([
+            "rank", pl.lit(1).alias("side"), pl.col("destination").alias("facility"),
+            no_flows.alias("outflows"), pl.col("count").alias("inflows"),
+        ]),
+    ])
+
+    top_2_facilities = (
+        flow_ends
+        .filter(~pl.col("facility").struct.field("facility_code").is_in(chicago_codes.implode()))
+        .sort(["rank", "side"])
+        .group_by(pl.col("facility").struct.field("facility_code").alias("code"), maintain_order=True)
+        .agg([
+            pl.col("facility").first(),
+            pl.col("outflows").sum(),
+            pl.col("inflows").sum(),
+        ])
+        # Sort facilities by total transfer count (inflows + outflows)
+        .with_columns((pl.col("outflows") + pl.col("inflows")).alias("total_transfers"))
+        .sort("total_transfers", descending=True, maintain_order=True)
+        .head(2)
+        .select([
+            "code",
+            pl.col("facility").struct.field("facility_name").alias("name"),
+            pl.col("facility").struct.field(["lat", "lon", "city", "state"]),
+            "outflows",
+            "inflows",
+            "total_transfers",
+        ])
+        .to_dicts()
+    )
 
-    for flow in aggregated_flows:
-        origin_code = flow["origin"]["facility_code"]
-        dest_code = flow["destination"]["facility_code"]
-        
-        # Track outflows from origin (if not Chicago)
-        if origin_code not in chicago_codes:
-            if origin_code not in facility_transfer_counts:
-                facility_transfer_counts[origin_code] = {
-                    "code": origin_code,
-                    "name": flow["origin"]["facility_name"],
-                    "lat": flow["origin"]["lat"],
-                    "lon": flow["origin"]["lon"],
-                    "city": flow["origin"]["city"],
-                    "state": flow["origin"]["state"],
-                    "outflows": 0,
-                    "inflows": 0,
-                    "destinations": {},
-                    "origins": {}
-                }
-            
-            facility_transfer_counts[origin_code]["outflows"] += flow["count"]
-            
-            dest_key = flow["destination"]["facility_code"]
-            if dest_key not in facility_transfer_counts[origin_code]["destinations"]:
-                facility_transfer_counts[origin_code]["destinations"][dest_key] = {
-                    "code": flow["destination"]["facility_code"],
-                    "name": flow["destination"]["facility_name"],
-                    "lat": flow["destination"]["lat"],
-                    "lon": flow["destination"]["lon"],
-                    "count": 0
-                }
-            facility_transfer_counts[origin_code]["destinations"][dest_key]["count"] += flow["count"]
-        
-        # Track inflows to destination (if not Chicago)
-        if dest_code not in chicago_codes:
-            if dest_code not in facility_transfer_counts:
-                facility_transfer_counts[dest_code] = {
-                    "code": dest_code,
-                    "name": flow["destination"]["facility_name"],
-                    "lat": flow["destination"]["lat"],
-                    "lon": flow["destination"]["lon"],
-                    "city": flow["destination"]["city"],
-                    "state": flow["destination"]["state"],
-                    "outflows": 0,
-                    "inflows": 0,
-                    "destinations": {},
-                    "origins": {}
-                }
-            
-            facility_transfer_counts[dest_code]["inflows"] += flow["count"]
-            
-            origin_key = flow["origin"]["facility_code"]
-            if origin_key not in facility_transfer_counts[dest_code]["origins"]:
-                facility_transfer_counts[dest_code]["origins"][origin_key] = {
-                    "code": flow["origin"]["facility_code"],
-                    "name": flow["origin"]["facility_name"],
-                    "lat": flow["origin"]["lat"],
-                    "lon": flow["origin"]["lon"],
-                    "count": 0
-                }
-            facility_transfer_counts[dest_code]["origins"][origin_key]["count"] += flow["count"]
-
-    # Sort facilities by total transfer count (inflows + outflows)
-    for facility in facility_transfer_counts.values():
-        facility["total_transfers"] = facility["outflows"] + facility["inflows"]
-
-    sorted_facilities = sorted(facility_transfer_counts.values(), key=lambda x: x["total_transfers"], reverse=True)
-    top_2_facilities = sorted_facilities[:2]
-
-    # Calculate top destinations and origins for each busiest facility
+    def top_linked(code, end, other):
+        """Top 5 facilities at the other end of the given facility's flows."""
+        return (
+            flows_df
+            .filter(pl.col(end).struct.field("facility_code") == code)
+            .head(5)
+            .select([
+                pl.col(other).struct.field("facility_code").alias("code"),
+                pl.col(other).struct.field("facility_name").alias("name"),
+                pl.col(other).struct.field(["lat", "lon"]),
+                "count",
+            ])
+            .to_dicts()
+        )
+
+    # Calculate top destinations and origins for each busiest facility.
+    # flows_df is sorted by count, so the first five matches are the top 5.
     for facility in top_2_facilities:
         # Top destinations (where people are transferred TO)
-        top_dests = sorted(facility["destinations"].values(), key=lambda x: x["count"], reverse=True)[:5]
-        for dest in top_dests:
-            dest["distance_km"] = haversine_distance(facility["lon"], facility["lat"], dest["lon"], dest["lat"])
-            dest["distance_miles"] = dest["distance_km"] * 0.621371
+        top_dests = top_linked(facility["code"], "origin", "destination")
         facility["top_destinations"] = top_dests
         
         # Top origins (where people are transferred FROM)
-        top_origs = sorted(facility["origins"].values(), key=lambda x: x["count"], reverse=True)[:5]
-        for origin in top_origs:
-            origin["distance_km"] = haversine_distance(facility["lon"], facility["lat"], origin["lon"], origin["lat"])
-            origin["distance_miles"] = origin["distance_km"] * 0.621371
+        top_origs = top_linked(facility["code"], "destination", "origin")
         facility["top_origins"] = top_origs
-        
-        del facility["destinations"]  # Remove full destinations dict
-        del facility["origins"]  # Remove full origins dict
+
+        # Distances from the facility to all of them in one pass
+        places = top_dests + top_origs
+        for place, distance_km in zip(places, distances_km([facility] * len(places), places)):
+            place["distance_km"] = distance_km
+            place["distance_miles"] = distance_km * KM_TO_MILES
 
     print(f"   Busiest facility #1: {top_2_facilities[0]['name']} ({top_2_facilities[0]['outflows']} out, {top_2_facilities[0]['inflows']} in)")
     print(f"   Busiest facility #2: {top_2_facilities[1]['name']} ({top_2_facilities[1]['outflows']} out, {top_2_facilities[1]['inflows']} in)")
@@ -613,23 +624,31 @@ def create_detention_journey_data():
     print("\n12. Writing output files...")
     WWW_DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-    with open(OUTPUT_FLOWS, 'w') as f:
-        json.dump(flows_output, f, indent=2)
+    # The flows list is the largest output; stream it one flow at a time
+    # like the removal flows instead of serialising it in one buffer
+    with open(OUTPUT_FLOWS, 'wb') as f:
+        f.write(b'{\n  "flows": [')
+        for i, flow in enumerate(flows_output["flows"]):
+            f.write(b",\n    " if i else b"\n    ")
+            f.write(orjson.dumps(flow))
+        f.write(b"\n  ],\n")
+        f.write(b'  "total_segments": ' + orjson.dumps(flows_output["total_segments"]) + b",\n")
+        f.write(b'  "unique_routes": ' + orjson.dumps(flows_output["unique_routes"]) + b"\n}\n")
     print(f"   ✓ Wrote {OUTPUT_FLOWS}")
 
-    with open(OUTPUT_HIGHLIGHTS, 'w') as f:
-        json.dump(highlights_output, f, indent=2)
+    OUTPUT_HIGHLIGHTS.write_bytes(orjson.dumps(highlights_output, option=orjson.OPT_INDENT_2))
     print(f"   ✓ Wrote {OUTPUT_HIGHLIGHTS}")
 
-    with open(OUTPUT_STATISTICS, 'w') as f:
-        json.dump(statistics_output, f, indent=2)
+    OUTPUT_STATISTICS.write_bytes(orjson.dumps(statistics_output, option=orjson.OPT_INDENT_2))
     print(f"   ✓ Wrote {OUTPUT_STATISTICS}")
 
+    write_manifest(MANIFEST_PATH, manifest)
+
     print("\n" + "=" * 80)
     print("COMPLETE!")
     print("=" * 80)
     print(f"\nSummary:")
-    print(f"  - Total detention records processed: {df_detentions.shape[0]:,}")
+    print(f"  - Total detention records processed: {valid_count:,}")
     print(f"  - Individuals with 2+ detentions: {len(paths_data):,}")
     print(f"  - Aggregated facility-pair routes: {len(aggregated_flows):,}")
     print(f"  - Total transfers across all routes: {flows_output['total_segments']:,}")
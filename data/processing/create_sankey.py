@@ -4,24 +4,27 @@ Creates sankey_data.json for the Sankey visualization.
 """
 
 import polars as pl
-import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from excel_cache import scan_excel
+from run_manifest import input_manifest, outputs_current, write_manifest
 
-def load_excel(path: Path) -> pl.DataFrame:
-    """Read a dataset with the common header row."""
-    return pl.read_excel(path, engine="calamine", read_options={"header_row": 6})
 
+STAGE_FLAGS = ["has_arrest", "has_detention", "has_removal"]
 
-def dedupe_first(df: pl.DataFrame, uid_col: str, date_col: str, alias: str) -> pl.DataFrame:
-    """Return earliest record per unique identifier for the given date column."""
+
+def stage_people(path: Path, date_col: str, flag: str, date_type=pl.Datetime) -> pl.LazyFrame:
+    """Return the identifiers with a dated record in a dataset, tagged with its stage flag."""
     return (
-        df.select([uid_col, date_col])
-        .filter(pl.col(uid_col).is_not_null() & pl.col(date_col).is_not_null())
-        .with_columns(pl.col(date_col).cast(pl.Datetime).alias("dt"))
-        .sort([uid_col, "dt"])
-        .unique(subset=[uid_col], keep="first")
-        .rename({uid_col: "Unique Identifier", "dt": alias})
+        scan_excel(path)
+        .select(["Unique Identifier", date_col])
+        .filter(pl.col("Unique Identifier").is_not_null() & pl.col(date_col).cast(date_type).is_not_null())
+        .select(
+            pl.col("Unique Identifier"),
+            *[pl.lit(name == flag).alias(name) for name in STAGE_FLAGS],
+        )
     )
 
 
@@ -39,56 +42,58 @@ def create_sankey_data():
 
     output_dir = script_dir.parent / "www/data"
     output_path = output_dir / "sankey_data.json"
+    manifest_path = script_dir / "cleaned" / "sankey_manifest.json"
 
-    print("Loading arrests, detentions, removals...")
-    df_arrests = load_excel(arrests_path)
-    df_detentions = load_excel(detentions_path)
-    df_removals = load_excel(removals_path)
-
-    arrest_people = dedupe_first(df_arrests, "Unique Identifier", "Apprehension Date", "arrest_date")
-    detention_people = dedupe_first(df_detentions, "Unique Identifier", "Stay Book In Date Time", "detention_date")
-    removal_people = (
-        df_removals.select(["Unique Identifier", "Departed Date"])
-        .filter(pl.col("Unique Identifier").is_not_null())
-        .with_columns(pl.col("Departed Date").cast(pl.Date).alias("removal_date"))
-        .filter(pl.col("removal_date").is_not_null())
-        .sort(["Unique Identifier", "removal_date"])
-        .unique(subset=["Unique Identifier"], keep="first")
-    )
-
-    all_ids = pl.concat(
-        [
-            arrest_people.select("Unique Identifier"),
-            detention_people.select("Unique Identifier"),
-            removal_people.select("Unique Identifier"),
-        ]
-    ).unique()
+    # The output depends only on the three workbooks, this script and the
+    # workbook cache, so the previous result is reused when none of them
+    # changed
+    manifest = input_manifest([arrests_path, detentions_path, removals_path, Path(__file__)])
+    if outputs_current(manifest_path, manifest, [output_path]):
+        print(f"Inputs unchanged since the last run; keeping {output_path}")
+        return orjson.loads(output_path.read_bytes())
 
+    print("Loading arrests, detentions, removals...")
+    # On a cold cache the three workbooks are parsed concurrently;
+    # calamine releases the GIL while decoding
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        stages = list(executor.map(
+            stage_people,
+            [arrests_path, detentions_path, removals_path],
+            ["Apprehension Date", "Stay Book In Date Time", "Departed Date"],
+            ["has_arrest", "has_detention", "has_removal"],
+            [pl.Datetime, pl.Datetime, pl.Date],
+        ))
+
+    # Stack the identifiers of all three datasets and hash the string key
+    # once in a single group_by, instead of deduplicating each dataset and
+    # left-joining all three onto the union of identifiers
     persons = (
-        all_ids
-        .join(arrest_people, on="Unique Identifier", how="left")
-        .join(detention_people, on="Unique Identifier", how="left")
-        .join(removal_people, on="Unique Identifier", how="left")
-        .with_columns(
-            [
-                pl.col("arrest_date").is_not_null().alias("has_arrest"),
-                pl.col("detention_date").is_not_null().alias("has_detention"),
-                pl.col("removal_date").is_not_null().alias("has_removal"),
-            ]
-        )
+        pl.concat(stages)
+        .group_by("Unique Identifier", maintain_order=False)
+        .agg(pl.col(STAGE_FLAGS).any())
     )
 
-    total_people = len(persons)
+    # Count every combination of stage flags in the same plan, so the
+    # per-person frame is never materialised; at most eight rows come back
+    stage_cube = persons.group_by(STAGE_FLAGS, maintain_order=False).len().collect(engine="streaming")
+    stage_counts = {row[:3]: row[3] for row in stage_cube.iter_rows()}
+
+    total_people = sum(stage_counts.values())
     print(f"Total unique people across datasets: {total_people:,}")
 
-    arrested = persons.filter(pl.col("has_arrest"))
-    detention_stage = persons.filter(pl.col("has_detention"))
+    def count_people(arrest=None, detention=None, removal=None):
+        """Sum people whose flags match every stage that is not None."""
+        wanted = (arrest, detention, removal)
+        return sum(
+            n for flags, n in stage_counts.items()
+            if all(w is None or w == f for w, f in zip(wanted, flags))
+        )
 
-    arrest_to_detention = arrested.filter(pl.col("has_detention")).height
-    arrest_to_no_detention = arrested.filter(~pl.col("has_detention")).height
-    no_ice_arrest_to_detention = persons.filter(~pl.col("has_arrest") & pl.col("has_detention")).height
-    detention_to_removal = detention_stage.filter(pl.col("has_removal")).height
-    detention_to_no_removal = detention_stage.filter(~pl.col("has_removal")).height
+    arrest_to_detention = count_people(arrest=True, detention=True)
+    arrest_to_no_detention = count_people(arrest=True, detention=False)
+    no_ice_arrest_to_detention = count_people(arrest=False, detention=True)
+    detention_to_removal = count_people(detention=True, removal=True)
+    detention_to_no_removal = count_people(detention=True, removal=False)
 
     links = []
     if arrest_to_detention:
@@ -106,11 +111,11 @@ def create_sankey_data():
 
     output_dir.mkdir(parents=True, exist_ok=True)
     print(f"\nSaving Sankey data to {output_path}...")
-    for link in links:
-        print(f"  {link['source']} → {link['target']}: {link['value']:,}")
+    if links:
+        print("\n".join(f"  {link['source']} → {link['target']}: {link['value']:,}" for link in links))
 
-    with open(output_path, "w") as f:
-        json.dump(output_data, f, indent=2)
+    output_path.write_bytes(orjson.dumps(output_data, option=orjson.OPT_INDENT_2))
+    write_manifest(manifest_path, manifest)
 
     print("Done.")
     return output_data
@@ -4,49 +4,64 @@ Creates timeline_data.json and timeline_data_by_country.json for the timeline vi
 """
 
 import polars as pl
-import json
+import orjson
 from pathlib import Path
 from datetime import datetime
 
+from excel_cache import scan_excel
 
-def load_data(file_path):
+
+# Integer year-month key added by add_year_month
+YEAR_MONTH_COL = "ym_int"
+
+
+def load_data(file_path, columns=None):
+    """
+    Loads a workbook through the shared Parquet cache.
+    Only the given columns are decoded.
     """
-    Loads Excel data using Polars with calamine engine.
-    Skips initial rows to find the correct header.
+    lf = scan_excel(file_path)
+    df = (lf.select(columns) if columns is not None else lf).collect()
+    print(f"Successfully loaded {len(df)} rows.")
+    return df
+
+
+def add_year_month(df, date_col):
     """
-    print(f"Loading data from {file_path}...")
-    try:
-        df = pl.read_excel(
-            file_path,
-            read_options={"header_row": 6},
-            engine="calamine"
-        )
-        print(f"Successfully loaded {len(df)} rows.")
-        return df
-    except Exception as e:
-        print(f"Error loading {file_path}: {e}")
-        raise
+    Parses date_col once and adds an integer year-month key (e.g. 202309).
+    Rows with a null date get a null key.
+    """
+    date_dt = pl.col(date_col).cast(pl.Datetime)
+    return df.with_columns(
+        (date_dt.dt.year() * 100 + date_dt.dt.month()).alias(YEAR_MONTH_COL)
+    )
+
+
+def year_month_key(year_month):
+    """Converts a "YYYY-MM" string to the integer key used by add_year_month."""
+    year, month = year_month.split("-")
+    return int(year) * 100 + int(month)
+
+
+def year_month_label(key):
+    """Converts an integer year-month key back to a "YYYY-MM" string."""
+    return f"{key // 100:04d}-{key % 100:02d}"
 
 
 def extract_monthly_counts(
     df,
-    date_col,
     identifier_col,
     event_type,
     start_date_filter=None,
-    unique_ids_filter=None,
-    deduplicate_first=False,
 ):
     """
-    Extract monthly counts from a dataset, deduplicating by Unique Identifier.
+    Extract monthly counts from a dataset, counting every dated record.
     
     Args:
-        df: Polars DataFrame
-        date_col: Name of the date column
+        df: Polars DataFrame annotated with add_year_month
         identifier_col: Name of the unique identifier column
         event_type: Name of the event type (for logging)
         start_date_filter: Optional start date filter (YYYY-MM string)
-        unique_ids_filter: Optional list of Unique Identifiers to filter by
     
     Returns:
         Dictionary with year-month as keys and counts as values
@@ -54,51 +69,27 @@ def extract_monthly_counts(
     print(f"\nProcessing {event_type}...")
     
     # Select columns we need
-    cols_to_select = [identifier_col, date_col]
+    cols_to_select = [identifier_col, YEAR_MONTH_COL]
     df_subset = df.select(cols_to_select)
     
-    # Filter by Unique Identifier if provided
-    if unique_ids_filter is not None:
-        df_subset = df_subset.filter(pl.col(identifier_col).is_in(unique_ids_filter))
-        print(f"  Filtered to {len(df_subset)} records matching provided Unique Identifiers")
-    
     # Remove rows with null ids or dates
     df_subset = df_subset.filter(
-        pl.col(identifier_col).is_not_null() & pl.col(date_col).is_not_null()
+        pl.col(identifier_col).is_not_null() & pl.col(YEAR_MONTH_COL).is_not_null()
     )
     print(f"  Records with valid ids/dates: {len(df_subset)}")
     
-    # Convert to datetime
-    df_subset = df_subset.with_columns([
-        pl.col(date_col).cast(pl.Datetime).alias("date_dt")
-    ])
-
-    # Optional deduplication: keep first occurrence per identifier (first detention per person)
-    if deduplicate_first:
-        df_subset = (
-            df_subset
-            .sort([identifier_col, "date_dt"])
-            .unique(subset=[identifier_col], keep="first")
-        )
-        print(f"  After deduping first occurrence: {len(df_subset)} records")
-    
-    # Extract year-month as string "YYYY-MM"
-    df_subset = df_subset.with_columns([
-        pl.col("date_dt").dt.strftime("%Y-%m").alias("year_month")
-    ])
-    
     # Filter by start date if provided
     if start_date_filter:
-        df_subset = df_subset.filter(pl.col("year_month") >= start_date_filter)
+        df_subset = df_subset.filter(pl.col(YEAR_MONTH_COL) >= year_month_key(start_date_filter))
         print(f"  After filtering from {start_date_filter}: {len(df_subset)} records")
     
     # Aggregate by year-month (keeping all occurrences)
-    monthly_counts = df_subset.group_by("year_month").len().sort("year_month")
+    monthly_counts = df_subset.group_by(YEAR_MONTH_COL, maintain_order=False).len().sort(YEAR_MONTH_COL)
     
-    # Convert to dictionary
+    # Convert to dictionary, turning the integer keys back into "YYYY-MM"
     result = {}
-    for row in monthly_counts.iter_rows(named=True):
-        result[row["year_month"]] = row["len"]
+    for key, count in monthly_counts.iter_rows():
+        result[year_month_label(key)] = count
     
     if result:
         print(f"  Date range: {min(result.keys())} to {max(result.keys())}")
@@ -109,6 +100,54 @@ def extract_monthly_counts(
     return result
 
 
+def extract_monthly_counts_by_country(
+    df,
+    identifier_col,
+    event_type,
+    id_country,
+    country_col,
+    start_date_filter=None,
+):
+    """
+    Extract monthly counts for every country in a single pass over a dataset.
+    
+    Args:
+        df: Polars DataFrame annotated with add_year_month
+        identifier_col: Name of the unique identifier column
+        event_type: Name of the event type (for logging)
+        id_country: Polars DataFrame mapping identifier_col to country_col
+        country_col: Name of the country column in id_country
+        start_date_filter: Optional start date filter (YYYY-MM string)
+    
+    Returns:
+        Dictionary with country as keys and {year-month: count} dictionaries as values
+    """
+    print(f"\nProcessing {event_type} by country...")
+    
+    # Attach the country once with a join instead of filtering per country
+    monthly = (
+        df.lazy()
+        .select([identifier_col, YEAR_MONTH_COL])
+        .filter(pl.col(identifier_col).is_not_null() & pl.col(YEAR_MONTH_COL).is_not_null())
+        .join(id_country.lazy(), on=identifier_col, how="inner")
+    )
+    
+    if start_date_filter:
+        monthly = monthly.filter(pl.col(YEAR_MONTH_COL) >= year_month_key(start_date_filter))
+    
+    monthly_counts = monthly.group_by([country_col, YEAR_MONTH_COL], maintain_order=False).len().collect()
+    
+    # Convert to nested dictionary
+    result = {}
+    for country, key, count in monthly_counts.iter_rows():
+        result.setdefault(country, {})[year_month_label(key)] = count
+    
+    print(f"  Countries with data: {len(result)}")
+    print(f"  Total {event_type}: {monthly_counts['len'].sum():,}")
+    
+    return result
+
+
 def create_timeline_data():
     """
     Creates timeline data showing monthly counts of arrests, detentions, and removals.
@@ -132,9 +171,14 @@ def create_timeline_data():
     start_date = "2023-09"
     
     # Load all datasets
-    df_arrests = load_data(arrests_path)
-    df_detentions = load_data(detentions_path)
-    df_removals = load_data(removals_path)
+    df_arrests = load_data(arrests_path, ["Unique Identifier", "Apprehension Date"])
+    df_detentions = load_data(detentions_path, ["Unique Identifier", "Book In Date Time"])
+    df_removals = load_data(removals_path, ["Unique Identifier", "Departed Date", "Citizenship Country"])
+    
+    # Parse each date column once; every pass below reuses the month key
+    df_arrests = add_year_month(df_arrests, "Apprehension Date")
+    df_detentions = add_year_month(df_detentions, "Book In Date Time")
+    df_removals = add_year_month(df_removals, "Departed Date")
     
     # Get unique countries from Removals (Citizenship Country)
     print("\nExtracting unique countries from Removals...")
@@ -151,7 +195,6 @@ def create_timeline_data():
     
     arrests_monthly_all = extract_monthly_counts(
         df_arrests, 
-        "Apprehension Date", 
         "Unique Identifier",
         "Arrests (All)",
         start_date_filter=start_date
@@ -159,7 +202,6 @@ def create_timeline_data():
     
     detentions_monthly_all = extract_monthly_counts(
         df_detentions,
-        "Book In Date Time",
         "Unique Identifier",
         "Detentions (All)",
         start_date_filter=start_date
@@ -167,7 +209,6 @@ def create_timeline_data():
     
     removals_monthly_all = extract_monthly_counts(
         df_removals,
-        "Departed Date",
         "Unique Identifier",
         "Removals (All)",
         start_date_filter=start_date
@@ -211,8 +252,7 @@ def create_timeline_data():
     # Save aggregated data
     output_dir.mkdir(parents=True, exist_ok=True)
     print(f"\nSaving aggregated timeline data to {output_path_all}...")
-    with open(output_path_all, 'w') as f:
-        json.dump(output_data_all, f, indent=2)
+    output_path_all.write_bytes(orjson.dumps(output_data_all, option=orjson.OPT_INDENT_2))
     
     print(f"Done. Generated {len(data_all)} monthly data points.")
     print(f"Totals - Arrests: {totals_all['arrests']:,}, Detentions: {totals_all['detentions']:,}, Removals: {totals_all['removals']:,}")
@@ -227,53 +267,43 @@ def create_timeline_data():
     removals_id_country = df_removals.select(["Unique Identifier", "Citizenship Country"]).filter(
         pl.col("Citizenship Country").is_not_null() & 
         pl.col("Unique Identifier").is_not_null()
-    )
+    ).unique()
     print(f"  Mapped {len(removals_id_country)} Unique Identifiers to countries")
     
-    # Process each country
+    # One grouped pass per dataset instead of one filtered pass per country
+    arrests_by_country = extract_monthly_counts_by_country(
+        df_arrests,
+        "Unique Identifier",
+        "Arrests",
+        removals_id_country,
+        "Citizenship Country",
+        start_date_filter=start_date
+    )
+    
+    detentions_by_country = extract_monthly_counts_by_country(
+        df_detentions,
+        "Unique Identifier",
+        "Detentions",
+        removals_id_country,
+        "Citizenship Country",
+        start_date_filter=start_date
+    )
+    
+    removals_by_country = extract_monthly_counts_by_country(
+        df_removals,
+        "Unique Identifier",
+        "Removals",
+        removals_id_country,
+        "Citizenship Country",
+        start_date_filter=start_date
+    )
+    
+    # Assemble each country's series from the grouped counts
     country_data = {}
-    for i, country in enumerate(countries, 1):
-        print(f"\n[{i}/{len(countries)}] Processing {country}...")
-        
-        # Get Unique Identifiers for this country
-        country_ids = removals_id_country.filter(
-            pl.col("Citizenship Country") == country
-        ).select("Unique Identifier")
-        country_id_list = country_ids["Unique Identifier"].to_list()
-        
-        if not country_id_list:
-            print(f"  No Unique Identifiers found for {country}")
-            continue
-        
-        print(f"  Found {len(country_id_list)} Unique Identifiers")
-        
-        # Extract monthly counts for this country
-        arrests_monthly = extract_monthly_counts(
-            df_arrests,
-            "Apprehension Date",
-            "Unique Identifier",
-            f"Arrests ({country})",
-            start_date_filter=start_date,
-            unique_ids_filter=country_id_list
-        )
-        
-        detentions_monthly = extract_monthly_counts(
-            df_detentions,
-            "Book In Date Time",
-            "Unique Identifier",
-            f"Detentions ({country})",
-            start_date_filter=start_date,
-            unique_ids_filter=country_id_list
-        )
-        
-        removals_monthly = extract_monthly_counts(
-            df_removals,
-            "Departed Date",
-            "Unique Identifier",
-            f"Removals ({country})",
-            start_date_filter=start_date,
-            unique_ids_filter=country_id_list
-        )
+    for country in countries:
+        arrests_monthly = arrests_by_country.get(country, {})
+        detentions_monthly = detentions_by_country.get(country, {})
+        removals_monthly = removals_by_country.get(country, {})
         
         # Get all unique year-months for this country
         country_months = set(arrests_monthly.keys()) | set(detentions_monthly.keys()) | set(removals_monthly.keys())
@@ -300,8 +330,7 @@ def create_timeline_data():
     
     # Save by-country data
     print(f"\nSaving by-country timeline data to {output_path_by_country}...")
-    with open(output_path_by_country, 'w') as f:
-        json.dump(output_data_by_country, f, indent=2)
+    output_path_by_country.write_bytes(orjson.dumps(output_data_by_country, option=orjson.OPT_INDENT_2))
     
     print(f"Done. Generated data for {len(country_data)} countries.")
     
@@ -0,0 +1,92 @@
+"""
+Parquet cache for the ICE Excel workbooks.
+Parsing the .xlsx files dominates the pipeline, so each sheet is parsed once
+and stored as <name>.cached.parquet next to the workbook.
+"""
+
+import os
+import polars as pl
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+# Every ICE sheet has this key column. Declaring its type skips inference
+# for it and keeps identifiers as strings even if a sheet's first rows
+# look numeric.
+SCHEMA_OVERRIDES = {"Unique Identifier": pl.String}
+
+# Stored in each cache's Parquet metadata. Bump it whenever the way sheets
+# are parsed changes (header row, SCHEMA_OVERRIDES), so caches written with
+# the old options are rebuilt instead of serving the old column types.
+CACHE_VERSION_KEY = "excel_cache_version"
+CACHE_VERSION = "1"
+
+
+def cache_path_for(file_path: Path) -> Path:
+    """Return the Parquet cache path for a workbook."""
+    return file_path.with_suffix(".cached.parquet")
+
+
+def cache_is_current(cache_path: Path, file_path: Path) -> bool:
+    """Return whether the cache is at least as new as the workbook and in the current format."""
+    if not cache_path.exists() or cache_path.stat().st_mtime < file_path.stat().st_mtime:
+        return False
+    return pl.read_parquet_metadata(cache_path).get(CACHE_VERSION_KEY) == CACHE_VERSION
+
+
+def scan_excel(file_path: Path) -> pl.LazyFrame:
+    """
+    Returns a LazyFrame over the workbook's sheet.
+    The cache is rebuilt when missing, older than the workbook or written by
+    another cache version, otherwise it is scanned so only the columns a
+    query needs are decoded.
+    """
+    cache_path = cache_path_for(file_path)
+    if cache_is_current(cache_path, file_path):
+        print(f"Scanning cached data from {cache_path}...")
+        return pl.scan_parquet(cache_path)
+
+    print(f"Loading data from {file_path}...")
+    try:
+        # Based on exploration, header is at row index 6 (7th row).
+        # Every column is parsed so the cache can serve any projection.
+        df = pl.read_excel(
+            file_path,
+            read_options={"header_row": 6},
+            schema_overrides=SCHEMA_OVERRIDES,
+            engine="calamine"
+        )
+        print(f"Successfully loaded {len(df)} rows.")
+    except Exception as e:
+        print(f"Error loading {file_path}: {e}")
+        raise
+
+    # Write to a per-process temporary file first so an interrupted or
+    # concurrent run never leaves a truncated cache behind
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    df.write_parquet(
+        tmp_path,
+        compression="zstd",
+        compression_level=3,
+        statistics=True,
+        metadata={CACHE_VERSION_KEY: CACHE_VERSION},
+    )
+    tmp_path.replace(cache_path)
+    print(f"Cached parsed sheet to {cache_path}")
+    return df.lazy()
+
+
+def warm_caches():
+    """
+    Builds the Parquet cache of every ICE workbook, parsing stale ones
+    concurrently. Later steps then only scan Parquet.
+    """
+    base_path = Path(__file__).parent.parent / "raw/ice_release_11aug2025_with_removals"
+    workbooks = sorted(base_path.glob("*.xlsx"))
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        list(executor.map(scan_excel, workbooks))
+    print(f"{len(workbooks)} workbook caches are current.")
+
+
+if __name__ == "__main__":
+    warm_caches()
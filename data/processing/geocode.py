@@ -6,35 +6,104 @@ Adds latitude and longitude coordinates for visualization.
 import polars as pl
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
+from geopy.exc import GeocoderRateLimited, GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import json
+import os
+import sqlite3
+import threading
 import time
 
 
+# The public Nominatim server allows 1 request per second, so it is queried
+# serially. Point NOMINATIM_DOMAIN at a self-hosted or paid instance to
+# geocode concurrently.
+PUBLIC_NOMINATIM_DOMAIN = "nominatim.openstreetmap.org"
+NOMINATIM_DOMAIN = os.environ.get("NOMINATIM_DOMAIN", PUBLIC_NOMINATIM_DOMAIN)
+MAX_WORKERS = 8
+# Optional pause between the requests of each concurrent worker, in seconds
+WORKER_MIN_DELAY = float(os.environ.get("NOMINATIM_WORKER_MIN_DELAY", "0"))
+# Rate limiting (429), server errors (5xx) and timeouts are retried with
+# exponential backoff: 2s, 4s, 8s, or the server's Retry-After
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 2
+
+
+def is_retryable(error):
+    """
+    Returns whether a geocoding error is transient. Query, quota and
+    authentication errors subclass GeocoderServiceError but are not retried.
+    """
+    return (
+        isinstance(error, (GeocoderRateLimited, GeocoderTimedOut, GeocoderUnavailable))
+        or type(error) is GeocoderServiceError
+    )
+
+
 def get_unique_locations(df, columns):
     """
     Extracts unique values from specified columns.
-    Returns a set of unique location strings.
+    Returns a list of unique location strings, deduplicated across columns.
     """
-    unique_locs = set()
-    for col in columns:
-        if col in df.columns:
-            # Drop nulls and convert to list
-            locs = df[col].drop_nulls().unique().to_list()
-            unique_locs.update(locs)
-    return unique_locs
+    present = [col for col in columns if col in df.columns]
+    if not present:
+        return []
+    # Stack the columns into one and let Polars dedupe once across all of them
+    return (
+        df.lazy()
+        .select(present)
+        .unpivot(value_name="location")
+        .select(pl.col("location").drop_nulls().unique())
+        .collect()
+        .to_series()
+        .to_list()
+    )
 
 
-def load_cache(cache_path):
-    if cache_path.exists():
-        with open(cache_path, 'r') as f:
-            return json.load(f)
-    return {}
+def open_cache(cache_path, legacy_json_path=None):
+    """
+    Opens the SQLite location cache, creating it if needed.
+    Entries from an older JSON cache are imported on first use.
+    """
+    is_new = not cache_path.exists()
+    conn = sqlite3.connect(cache_path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS locations ("
+        "name TEXT PRIMARY KEY, lat REAL, lon REAL, address TEXT)"
+    )
+    if is_new and legacy_json_path is not None and legacy_json_path.exists():
+        with open(legacy_json_path, 'r') as f:
+            legacy = json.load(f)
+        print(f"Importing {len(legacy)} cached locations from {legacy_json_path}...")
+        for loc, data in legacy.items():
+            save_location(conn, loc, data, commit=False)
+        conn.commit()
+    return conn
+
+
+def load_cache(conn):
+    """
+    Returns the cache as {location: {"lat", "lon", "address"}}.
+    Locations that were not found map to None.
+    """
+    cache = {}
+    for name, lat, lon, address in conn.execute("SELECT name, lat, lon, address FROM locations"):
+        cache[name] = {"lat": lat, "lon": lon, "address": address} if lat is not None else None
+    return cache
 
 
-def save_cache(cache, cache_path):
-    with open(cache_path, 'w') as f:
-        json.dump(cache, f, indent=4)
+def save_location(conn, loc, data, commit=True):
+    """
+    Upserts a single location. data=None records a failed lookup.
+    """
+    if data:
+        row = (loc, data["lat"], data["lon"], data["address"])
+    else:
+        row = (loc, None, None, None)
+    conn.execute("INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?)", row)
+    if commit:
+        conn.commit()
 
 
 def clean_location_name(loc):
@@ -57,9 +126,14 @@ def clean_location_name(loc):
 
 
 def geocode_locations():
+    """
+    Geocodes the location columns of unified_removals.parquet and writes
+    unified_removals_with_geo.parquet. Returns the geocoded frame.
+    """
     script_dir = Path(__file__).parent.parent
     data_path = script_dir / "cleaned/unified_removals.parquet"
-    cache_path = script_dir / "cleaned/location_cache.json"
+    cache_path = script_dir / "cleaned/location_cache.sqlite"
+    legacy_cache_path = script_dir / "cleaned/location_cache.json"
     mapping_path = script_dir / "cleaned/location_mappings.parquet"
     output_path = script_dir / "cleaned/unified_removals_with_geo.parquet"
 
@@ -74,48 +148,82 @@ def geocode_locations():
     print(f"Found {len(unique_locs)} unique locations to geocode.")
 
     # Initialize Geolocator
-    geolocator = Nominatim(user_agent="inter_gravity_project", timeout=10)
-    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1.0)
+    geolocator = Nominatim(user_agent="inter_gravity_project", timeout=10, domain=NOMINATIM_DOMAIN)
 
     # Load cache
-    location_cache = load_cache(cache_path)
+    conn = open_cache(cache_path, legacy_cache_path)
+    location_cache = load_cache(conn)
     
-    # Geocode
-    updated = False
-    for i, loc in enumerate(unique_locs):
-        if loc not in location_cache or location_cache[loc] is None:
-            # Try to geocode if not in cache OR if previously failed (None)
-            # We retry None because we might have improved the cleaning logic
-            
-            cleaned_loc = clean_location_name(loc)
-            print(f"Geocoding ({i+1}/{len(unique_locs)}): {loc} -> {cleaned_loc}")
-            
+    # Geocode if not in cache OR if previously failed (None)
+    # We retry None because we might have improved the cleaning logic
+    pending = [loc for loc in unique_locs if location_cache.get(loc) is None]
+    print(f"{len(pending)} locations are not cached yet.")
+
+    def lookup(geocode, loc):
+        """Geocodes one location. Returns (loc, data, error)."""
+        cleaned_loc = clean_location_name(loc)
+        for attempt in range(MAX_RETRIES + 1):
             try:
                 location = geocode(cleaned_loc)
-                if location:
-                    location_cache[loc] = {
-                        "lat": location.latitude,
-                        "lon": location.longitude,
-                        "address": location.address
-                    }
-                else:
-                    print(f"  -> Not found: {loc}")
-                    location_cache[loc] = None # Mark as not found to avoid retrying
-                
-                updated = True
-                # Save periodically
-                if i % 10 == 0:
-                    save_cache(location_cache, cache_path)
+                break
             except Exception as e:
-                print(f"  -> Error geocoding {loc}: {e}")
-                time.sleep(2) # Wait a bit longer on error
-        else:
-            # print(f"Skipping cached: {loc}")
-            pass
+                if attempt == MAX_RETRIES or not is_retryable(e):
+                    return loc, None, e
+                delay = getattr(e, "retry_after", None) or BACKOFF_SECONDS * 2 ** attempt
+                print(f"  -> Retrying {loc} in {delay}s after: {e}")
+                time.sleep(delay)
+        if location:
+            return loc, {
+                "lat": location.latitude,
+                "lon": location.longitude,
+                "address": location.address
+            }, None
+        return loc, None, None
+
+    def record(i, result):
+        loc, data, error = result
+        print(f"Geocoded ({i}/{len(pending)}): {loc} -> {clean_location_name(loc)}")
+        if error is not None:
+            # Leave errors uncached so the next run retries them
+            print(f"  -> Error geocoding {loc}: {error}")
+            return
+        if data is None:
+            print(f"  -> Not found: {loc}")
+        # One row per lookup instead of rewriting the whole cache
+        location_cache[loc] = data
+        save_location(conn, loc, data)
+
+    # Errors are raised to lookup, which does the retrying, instead of being
+    # swallowed by the rate limiter
+    def rate_limited(min_delay):
+        return RateLimiter(
+            geolocator.geocode,
+            min_delay_seconds=min_delay,
+            max_retries=0,
+            swallow_exceptions=False,
+        )
+
+    if NOMINATIM_DOMAIN == PUBLIC_NOMINATIM_DOMAIN:
+        geocode = rate_limited(1.0)
+        for i, loc in enumerate(pending, 1):
+            record(i, lookup(geocode, loc))
+    else:
+        print(f"Geocoding concurrently against {NOMINATIM_DOMAIN} with {MAX_WORKERS} workers...")
+        # Each worker thread gets its own limiter, so the minimum delay
+        # applies per worker rather than across all of them
+        worker = threading.local()
 
-    if updated:
-        save_cache(location_cache, cache_path)
-        print("Cache updated.")
+        def worker_lookup(loc):
+            if not hasattr(worker, "geocode"):
+                worker.geocode = rate_limited(WORKER_MIN_DELAY)
+            return lookup(worker.geocode, loc)
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = [executor.submit(worker_lookup, loc) for loc in pending]
+            for i, future in enumerate(as_completed(futures), 1):
+                record(i, future.result())
+
+    conn.close()
 
     # Create Mapping DataFrame
     print("Creating mapping DataFrame...")
@@ -139,28 +247,31 @@ def geocode_locations():
     # Join back to main dataset
     print("Merging coordinates back to main dataset...")
     
-    # We need to join for each column. 
-    # Since they are different columns, we'll do it sequentially or stack?
-    # Easier to join on each column and rename
-    
-    df_final = df
-    
+    # Map each column through the small location -> lat/lon lookup with
+    # replace_strict instead of a left join per column, which copied the
+    # whole frame three times. Unmatched locations get null coordinates.
+    location_names = df_mapping["location_name"]
+    coordinate_cols = []
     for col in target_cols:
-        # Prepare mapping for this column
-        # Rename columns to avoid collision: lat -> {col}_lat
+        # Name coordinates after the column: lat -> {col}_lat
         suffix = col.lower().replace(" ", "_")
-        
-        mapping_renamed = df_mapping.rename({
-            "location_name": col,
-            "lat": f"{suffix}_lat",
-            "lon": f"{suffix}_lon"
-        })
-        
-        df_final = df_final.join(mapping_renamed, on=col, how="left")
+        for coord in ["lat", "lon"]:
+            coordinate_cols.append(
+                pl.col(col)
+                .replace_strict(location_names, df_mapping[coord], default=None, return_dtype=pl.Float64)
+                .alias(f"{suffix}_{coord}")
+            )
+    
+    df_final = df.with_columns(coordinate_cols)
+
+    # Sort on the columns downstream steps filter and group by, so the
+    # per-row-group statistics let readers skip whole row groups
+    df_final = df_final.sort(["Apprehension State", "Departure Country"], nulls_last=True)
 
     print(f"Saving final dataset with coordinates to {output_path}...")
-    df_final.write_parquet(output_path)
+    df_final.write_parquet(output_path, compression="zstd", statistics=True, row_group_size=100_000)
     print("Done.")
+    return df_final
 
 
 if __name__ == "__main__":
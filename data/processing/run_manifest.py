@@ -0,0 +1,40 @@
+"""
+Input manifests for the steps that skip themselves when nothing changed.
+A manifest maps each input's file name to its [st_mtime_ns, st_size] and is
+stored as JSON in data/cleaned/.
+"""
+
+import orjson
+from pathlib import Path
+
+
+# Workbooks are read through the Parquet cache, so a change to how sheets
+# are parsed can change the output of every step that uses it
+EXCEL_CACHE_PATH = Path(__file__).parent / "excel_cache.py"
+
+
+def input_manifest(paths):
+    """Return the manifest of the given inputs, always including excel_cache.py."""
+    return {
+        path.name: [path.stat().st_mtime_ns, path.stat().st_size]
+        for path in [*paths, EXCEL_CACHE_PATH]
+    }
+
+
+def outputs_current(manifest_path: Path, manifest, outputs) -> bool:
+    """Return whether every output exists and was written from the same inputs."""
+    return (
+        manifest_path.exists()
+        and all(path.exists() for path in outputs)
+        and orjson.loads(manifest_path.read_bytes()) == manifest
+    )
+
+
+def write_manifest(manifest_path: Path, manifest):
+    """
+    Records the inputs of a finished run.
+    Call it after the outputs are written, so an interrupted run is never
+    mistaken for a complete one.
+    """
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest_path.write_bytes(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))